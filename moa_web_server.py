@@ -3,17 +3,40 @@ import sys
 import re
 import glob
 import os
+import pty
+import struct
 import asyncio
 import time
+import functools
 import logging
+from typing import Literal
 from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import PlainTextResponse
-from pydantic import BaseModel, validator
-from bleak import BleakClient, BleakScanner
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from pydantic import BaseModel, model_validator
+from bleak import BleakScanner
+from bleak.exc import BleakError
+from bleak_retry_connector import establish_connection, BleakClientWithServiceCache
 import uvicorn
-import pexpect
-
-app = FastAPI()
+import orjson
+from tenacity import (retry, stop_after_attempt, wait_exponential_jitter,
+                      retry_if_exception_type, before_sleep_log)
+
+class ORJSONResponse(JSONResponse):
+    """JSON response encoded with orjson, which is considerably faster than the json module."""
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# Logging is kept to warnings and above by default; set MOA_LOG=INFO or MOA_LOG=DEBUG to troubleshoot.
+LOG_LEVEL = os.environ.get("MOA_LOG", "WARNING").upper()
+LOG_LEVEL_VALID = LOG_LEVEL in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+logging.basicConfig(level=LOG_LEVEL if LOG_LEVEL_VALID else logging.WARNING,
+                    format='%(asctime)s [%(levelname)s] %(message)s')
+logging.getLogger("bleak").setLevel(logging.WARNING)
+log = logging.getLogger("moa")
+if not LOG_LEVEL_VALID:
+    log.warning(f"Unknown MOA_LOG level '{LOG_LEVEL}', using WARNING.")
 
 BANNER = r"""
 ########################################################################################################
@@ -25,9 +48,10 @@ BANNER = r"""
 #
 # Setting the heating element progmatically can result in eroneous values being set, particularly
 # when switching between modes 5 and 6, which results in target temperatures being doubled. To work
-# around this, this utility always first sets (and confirms) mode 0 (off), then sets (and confirms)
-# the target mode. If the correct values are not reported back after several retries, the device is
-# then set to mode 0 (off). Input values are also clamped within manufacturer provided ranges.
+# around this, this utility first sets (and confirms) mode 0 (off) unless the element is already off
+# or already in the target mode, then sets (and confirms) the target mode. If the correct values are
+# not reported back after several retries, the device is then set to mode 0 (off). Input values are
+# also clamped within manufacturer provided ranges.
 #
 # DO NOT REMOVE ANY OF THIS PROTECTION AND VALIDATION LOGIC. ALL TOWEL RAILS REQUIRE EXPANSION SPACE
 # TO ACCOMODATE THE EXPANSION OF THEIR CONTENTS WHEN HEATED SUFFICIENT TO ACCOMMODATE THE CONTENTS AT
@@ -96,7 +120,7 @@ Functions provided:
   Provided for troubleshooting, returns all raw data retrieved from device.
 
 /discover?timeout=XX.X
-  Lists all devices and their associated addresses visible. If timeout is omitted uses 15s.
+  Lists all devices and their associated addresses visible. If timeout is omitted uses 5s.
 
 Because the sensor in the element is typically installed at floor level, this can result in low
 readings, for example in buildings with poor floor insulation. To solve this problem and enable more
@@ -123,39 +147,43 @@ more than enough.
 
 """
 
-# Serve banner and help information when the root URL is requested.
+# Serve banner and help information when the root URL is requested. The text never changes, so it
+# is built and encoded once.
+ROOT_BYTES = (BANNER + "\n\n" + HELP).encode("utf-8")
+
 @app.get("/", response_class=PlainTextResponse)
 async def root():
-    return BANNER + "\n\n" + HELP
+    return Response(content=ROOT_BYTES, media_type="text/plain; charset=utf-8")
 
 
 # Terma specific UUIDs and temperature encode/decode
 ROOM_TEMP_UUID      = "d97352b1-d19e-11e2-9e96-0800200c9a66"  # For room temperature mode (mode 5)
 HEATER_TEMP_UUID    = "d97352b2-d19e-11e2-9e96-0800200c9a66"  # For heater temperature mode (mode 6)
 OPERATING_MODE_UUID = "d97352b3-d19e-11e2-9e96-0800200c9a66"  # Operating mode (0, 5, or 6)
+TEMPERATURE_STRUCT  = struct.Struct(">HH")  # Big-endian u16 current and target, each in 0.1°C
 
 def decode_temperature(data: bytes) -> (float, float):
     if len(data) < 4:
         raise ValueError("Temperature data too short")
-    current = ((data[0] * 255) + data[1]) / 10.0
-    target  = ((data[2] * 255) + data[3]) / 10.0
-    return current, target
+    current, target = TEMPERATURE_STRUCT.unpack_from(data)
+    return current / 10.0, target / 10.0
 
 def encode_temperature(target: float) -> bytes:
     """
     Encode a target temperature (°C) into a 4-byte payload.
     The protocol expects the first two bytes to be zero and the last two bytes
-    represent target*10.
+    represent target*10 as a big-endian u16.
     """
     value = int(round(target * 10))
-    high = value // 255
-    low = value % 255
-    return bytes([0, 0, high, low])
+    if not 0 <= value <= 0xFFFF:
+        raise ValueError("Target temperature out of range")
+    return TEMPERATURE_STRUCT.pack(0, value)
 
 # Utility to validate a BLE address (e.g., "CC:22:37:10:43:4B")
+MAC_ADDRESS_RE = re.compile(r"[0-9A-Fa-f]{2}(:[0-9A-Fa-f]{2}){5}")
+
 def validate_address(addr: str) -> str:
-    parts = addr.split(":")
-    if len(parts) != 6 or not all(len(p) == 2 for p in parts):
+    if not MAC_ADDRESS_RE.fullmatch(addr):
         raise HTTPException(status_code=400, detail="Invalid address format.")
     return addr.upper()
 
@@ -166,78 +194,166 @@ def validate_address(addr: str) -> str:
 #
 PERSISTENT_CLIENTS = {}
 
+# BlueZ only has a handful of connection slots per adapter and fails with device-not-found errors
+# when they run out, so cap the number of Bluetooth operations in flight across all devices.
+BLE_SEMAPHORE = asyncio.Semaphore(int(os.environ.get("MOA_BLE_MAX_CONCURRENT", "4")))
+
+# Retry policy for device reads. Only Bluetooth/transport failures are retried; bad input (such as
+# an invalid address) and decoding errors fail straight away.
+ble_retry = retry(wait=wait_exponential_jitter(initial=0.3, max=3),
+                  stop=stop_after_attempt(3),
+                  retry=retry_if_exception_type((BleakError, asyncio.TimeoutError)),
+                  before_sleep=before_sleep_log(log, logging.WARNING),
+                  reraise=True)
+STATUS_CACHE_TTL = 2.0  # Seconds a /status result is reused for before the device is read again
+
 class PersistentBleClient:
     def __init__(self, address: str):
         self.address = validate_address(address)
         self.client = None
+        self.name = None
+        self.services_cache = None  # The GATT table never changes, so keep it until disconnect()
         self.lock = asyncio.Lock()
+        self._inflight_status = None  # Task for a status read that concurrent callers can share
+        self._status_cache = None     # (time.monotonic(), status) of the last successful read
+        self._status_generation = 0   # Bumped on invalidation so reads started earlier aren't cached
+        self.notifications_enabled = False
+        self.latest = {}  # Characteristic UUID -> last value notified by the device
+        self._notify_event = asyncio.Event()
 
     async def connect(self):
         async with self.lock:
             if self.client is not None and self.client.is_connected:
                 return self.client
-            # Create a new BleakClient instance for this address.
-            self.client = BleakClient(self.address, timeout=10.0)
-            await self._attempt_connect()
+            # bleak-retry-connector handles backoff between attempts and caches services across
+            # reconnects. Only if that gives up do we run bluetoothctl commands and try once more.
+            try:
+                self.client = await self._establish_connection()
+            except Exception as e:
+                log.warning(f"[PersistentBleClient] Normal connection attempts failed for {self.address}: {e}. Running bluetoothctl power on commands.")
+                await self._bluetoothctl_power_on()
+                try:
+                    self.client = await self._establish_connection()
+                except Exception as e:
+                    raise BleakError(f"Unable to connect to {self.address} after persistent reconnection attempts: {e}")
+            log.info(f"[PersistentBleClient] Connected to {self.address}.")
+            if self.services_cache is None:
+                self.services_cache = self.client.services
+            await self._start_notifications()
             return self.client
 
-    async def _attempt_connect(self):
-        attempts = 0
-        while attempts < 3:
+    async def _start_notifications(self):
+        # Subscribe to whichever of the Terma characteristics support notifications, so that
+        # set_thermostat can learn of new values as soon as the device commits them.
+        self.notifications_enabled = False
+        for uuid in (OPERATING_MODE_UUID, ROOM_TEMP_UUID, HEATER_TEMP_UUID):
+            char = self.client.services.get_characteristic(uuid)
+            if char is None or "notify" not in char.properties:
+                continue
             try:
-                print(f"[PersistentBleClient] Attempt {attempts+1} connecting to {self.address}...")
-                await self.client.connect()
-                if self.client.is_connected:
-                    print(f"[PersistentBleClient] Connected to {self.address} on attempt {attempts+1}.")
-                    return
+                async with BLE_SEMAPHORE:
+                    await self.client.start_notify(char, functools.partial(self._on_notify, uuid))
+                self.notifications_enabled = True
             except Exception as e:
-                print(f"[PersistentBleClient] Connection attempt {attempts+1} failed: {e}")
-            attempts += 1
-            await asyncio.sleep(3)
-        # After three normal attempts, run bluetoothctl commands.
-        print(f"[PersistentBleClient] Normal connection attempts failed for {self.address}. Running bluetoothctl power on commands.")
-        await self._bluetoothctl_power_on()
-        attempts = 0
-        while attempts < 3:
+                log.debug(f"[PersistentBleClient] Could not subscribe to {uuid} on {self.address}: {e}")
+
+    def _on_notify(self, uuid, _sender, data):
+        self.latest[uuid] = bytes(data)
+        self._notify_event.set()
+
+    async def wait_for_notification(self, predicate, timeout: float) -> bool:
+        """
+        Waits until predicate(self.latest) is true, re-checking after each notification.
+        Returns False if that doesn't happen within timeout seconds.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not predicate(self.latest):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            self._notify_event.clear()
             try:
-                print(f"[PersistentBleClient] Post-bluetoothctl attempt {attempts+1} connecting to {self.address}...")
-                await self.client.connect()
-                if self.client.is_connected:
-                    print(f"[PersistentBleClient] Connected to {self.address} after bluetoothctl on attempt {attempts+1}.")
-                    return
-            except Exception as e:
-                print(f"[PersistentBleClient] Post-bluetoothctl connection attempt {attempts+1} failed: {e}")
-            attempts += 1
-            await asyncio.sleep(3)
-        raise Exception(f"Unable to connect to {self.address} after persistent reconnection attempts.")
+                await asyncio.wait_for(self._notify_event.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def _establish_connection(self):
+        log.debug(f"[PersistentBleClient] Connecting to {self.address}...")
+        async with BLE_SEMAPHORE:
+            device = await BleakScanner.find_device_by_address(self.address, timeout=3.0)
+            if device is None:
+                raise Exception(f"Device {self.address} not found.")
+            self.name = device.name
+            return await establish_connection(BleakClientWithServiceCache, device, self.address,
+                                              max_attempts=3, use_services_cache=True)
 
     async def _bluetoothctl_power_on(self):
-        print("[PersistentBleClient] Running bluetoothctl power on commands.")
-        child = pexpect.spawn("bluetoothctl", encoding="utf-8", timeout=5)
-        child.sendline("power on")
-        time.sleep(2)
-        child.sendline("power on")
-        time.sleep(2)
-        child.sendline("exit")
-        child.close()
-        print("[PersistentBleClient] bluetoothctl power on commands executed.")
+        log.info("[PersistentBleClient] Running bluetoothctl power on commands.")
+        child = await AsyncBluetoothctl.spawn()
+        await child.sendline("power on")
+        await asyncio.sleep(2)
+        await child.sendline("power on")
+        await asyncio.sleep(2)
+        await child.sendline("exit")
+        await child.close()
+        log.info("[PersistentBleClient] bluetoothctl power on commands executed.")
 
     async def disconnect(self):
         async with self.lock:
+            self.services_cache = None
+            self.notifications_enabled = False
             if self.client and self.client.is_connected:
                 await self.client.disconnect()
-                print(f"[PersistentBleClient] Disconnected from {self.address}")
+                log.info(f"[PersistentBleClient] Disconnected from {self.address}")
+
+    async def read_status_coalesced(self):
+        """
+        Returns the device status, reusing a result less than STATUS_CACHE_TTL old. Callers
+        arriving while a read is already in progress wait for that read instead of starting
+        another one.
+        """
+        if self._status_cache is not None and time.monotonic() - self._status_cache[0] < STATUS_CACHE_TTL:
+            return self._status_cache[1]
+        if self._inflight_status is None:
+            self._inflight_status = asyncio.ensure_future(self._read_and_cache_status())
+        # Shield so that one caller going away doesn't cancel the read for everybody else.
+        return await asyncio.shield(self._inflight_status)
+
+    def invalidate_status_cache(self):
+        # A read already in progress may return values from before the write, so neither cache its
+        # result nor let new callers share it.
+        self._status_generation += 1
+        self._status_cache = None
+        self._inflight_status = None
+
+    async def _read_and_cache_status(self):
+        generation = self._status_generation
+        try:
+            status = await read_status(self.address)
+            if generation == self._status_generation:
+                self._status_cache = (time.monotonic(), status)
+            return status
+        finally:
+            if generation == self._status_generation:
+                self._inflight_status = None
 
 def get_persistent_client(address: str) -> PersistentBleClient:
-    address = validate_address(address)
-    if address not in PERSISTENT_CLIENTS:
-        PERSISTENT_CLIENTS[address] = PersistentBleClient(address)
-    return PERSISTENT_CLIENTS[address]
+    # Addresses already in the dict have been validated and upper-cased.
+    persistent_client = PERSISTENT_CLIENTS.get(address)
+    if persistent_client is None:
+        address = validate_address(address)
+        persistent_client = PERSISTENT_CLIENTS.get(address)
+        if persistent_client is None:
+            persistent_client = PERSISTENT_CLIENTS[address] = PersistentBleClient(address)
+    return persistent_client
 
 #########################################################################
 # ORIGINAL HELPER FUNCTIONS, REVISED TO USE THE PERSISTENT CONNECTION
 #
 
+@ble_retry
 async def query_device(address: str):
     """
     Scans for the device with the given MAC address (if needed)
@@ -245,15 +361,14 @@ async def query_device(address: str):
     This version uses the persistent connection.
     """
     address = validate_address(address)
-    print(f"[query_device] Querying device with address: {address}")
+    log.debug(f"[query_device] Querying device with address: {address}")
     persistent_client = get_persistent_client(address)
     client = await persistent_client.connect()
     # Optionally retrieve the device name via scanning.
     device_obj = await BleakScanner.find_device_by_address(address, timeout=3.0)
     device_name = device_obj.name if device_obj and device_obj.name else "Unknown"
     try:
-        # Force service discovery.
-        services = client.services
+        services = persistent_client.services_cache
         service_info = {}
         for service in services:
             char_info = {}
@@ -261,7 +376,8 @@ async def query_device(address: str):
                 data = {"properties": list(char.properties)}
                 if "read" in char.properties:
                     try:
-                        value = await client.read_gatt_char(char.uuid)
+                        async with BLE_SEMAPHORE:
+                            value = await client.read_gatt_char(char.uuid)
                         data["value"] = value.hex()
                     except Exception as read_exc:
                         data["value_error"] = str(read_exc)
@@ -277,100 +393,84 @@ async def query_device(address: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error connecting to device: {str(e)}")
 
-def get_char_value(services: dict, char_uuid: str):
+async def read_status_characteristics(client):
     """
-    Searches the services dictionary for the given characteristic UUID.
-    Returns the value as bytes (if available) or None.
+    Reads only the three Terma characteristics needed by read_status,
+    rather than every readable characteristic as query_device does.
+    Returns the raw (room, heater, mode) values as bytes.
     """
-    for svc, chars in services.items():
-        if char_uuid in chars:
-            val_hex = chars[char_uuid].get("value")
-            if val_hex is not None:
-                try:
-                    return bytes.fromhex(val_hex)
-                except Exception:
-                    return None
-    return None
+    async with BLE_SEMAPHORE:
+        return await asyncio.gather(client.read_gatt_char(ROOM_TEMP_UUID),
+                                    client.read_gatt_char(HEATER_TEMP_UUID),
+                                    client.read_gatt_char(OPERATING_MODE_UUID))
+
+# Path of the first DS18B20 sensor's w1_slave file, resolved on first use. None means not yet
+# resolved; an empty string means no sensor was found (sensors are only detected at boot).
+DS18B20_PATH = None
 
 def read_ds18b20_temp():
     """
     Reads the temperature from the first available DS18B20 sensor.
     Returns the temperature in degrees Celsius.
     """
-    base_dir = '/sys/bus/w1/devices'
-    sensor_folders = glob.glob(os.path.join(base_dir, '28-*'))
-    if not sensor_folders:
+    global DS18B20_PATH
+    if DS18B20_PATH is None:
+        base_dir = '/sys/bus/w1/devices'
+        sensor_folders = glob.glob(os.path.join(base_dir, '28-*'))
+        DS18B20_PATH = os.path.join(sensor_folders[0], 'w1_slave') if sensor_folders else ""
+    if not DS18B20_PATH:
         raise Exception("INFO: No DS18B20 sensor found")
-    sensor_folder = sensor_folders[0]
-    sensor_file = os.path.join(sensor_folder, 'w1_slave')
     
     try:
-        with open(sensor_file, 'r') as f:
-            lines = f.readlines()
+        with open(DS18B20_PATH, 'rb') as f:
+            buf = f.read()
     except Exception as e:
+        DS18B20_PATH = None  # Look for the sensor again next time
         raise Exception(f"Error reading DS18B20 sensor file: {str(e)}")
     
-    if lines[0].strip()[-3:] != "YES":
+    status_line, _, data = buf.partition(b"\n")
+    if status_line.strip()[-3:] != b"YES":
         raise Exception("DS18B20 sensor not ready")
     
-    equals_pos = lines[1].find('t=')
-    if equals_pos == -1:
+    parts = data.rsplit(b't=', 1)
+    if len(parts) != 2:
         raise Exception("Temperature reading not found in sensor output")
     
-    temp_string = lines[1][equals_pos+2:]
     try:
-        temp_c = float(temp_string) / 1000.0
+        temp_c = int(parts[1]) / 1000.0
     except ValueError:
         raise Exception("Invalid temperature format from DS18B20")
     
     return temp_c
 
+@ble_retry
 async def read_status(address: str):
     """
-    Uses query_device to retrieve the device dump,
-    then extracts measurement values from the known UUIDs.
+    Reads the known UUIDs with read_status_characteristics,
+    then decodes the measurement values from them.
     If a DS18B20 sensor is available, its reading is used.
     """
-    max_attempts = 3
-    for attempt in range(max_attempts):
-        try:
-            query = await query_device(address)
-            break  # Success – exit loop.
-        except Exception as e:
-            if attempt < max_attempts - 1:
-                print(f"[read_status] Attempt {attempt + 1} failed: {e}. Retrying...")
-                await asyncio.sleep(3)
-            else:
-                raise Exception(f"All {max_attempts} attempts failed: {e}")
+    address = validate_address(address)
+    persistent_client = get_persistent_client(address)
+    client = await persistent_client.connect()
+    room_data, heater_data, mode_data = await read_status_characteristics(client)
+
+    try:
+        room_current, room_target = decode_temperature(room_data)
+        heater_current, heater_target = decode_temperature(heater_data)
+    except Exception as exc:
+        raise Exception(f"Error decoding temperatures: {str(exc)}")
 
-    services = query.get("services", {})
-    room_data = get_char_value(services, ROOM_TEMP_UUID)
-    heater_data = get_char_value(services, HEATER_TEMP_UUID)
-    mode_data   = get_char_value(services, OPERATING_MODE_UUID)
-    
-    if room_data is None or heater_data is None or mode_data is None:
-        raise Exception("Missing measurement data in device services")
-    
     try:
         room_current = read_ds18b20_temp()
         room_temp_source = "DS18B20"
     except Exception:
-        try:
-            room_current, _ = decode_temperature(room_data)
-        except Exception as e:
-            raise Exception(f"Error decoding current room temperature: {str(e)}")
         room_temp_source = "HeatingElement"
-    
-    try:
-        _, room_target = decode_temperature(room_data)
-        heater_current, heater_target = decode_temperature(heater_data)
-    except Exception as exc:
-        raise Exception(f"Error decoding room target temperature: {str(exc)}")
-    
+
     mode = mode_data[0] if len(mode_data) >= 1 else None
     return {
         "device": address,
-        "name": query.get("name"),
+        "name": persistent_client.name or "Unknown",
         "mode": mode,
         "room_current_temp": room_current,
         "room_target_temp": room_target,
@@ -380,51 +480,27 @@ async def read_status(address: str):
     }
 
 class SetRequest(BaseModel):
-    mode: int         # Allowed values: 0 (off), 5 (room mode), or 6 (heater mode)
-    target_temp: float  # Desired target temperature in ºC
-
-    @validator("mode")
-    def validate_mode(cls, v):
-        if v not in [0, 5, 6]:
-            raise ValueError("Invalid mode; must be 0, 5, or 6")
-        return v
-
-    @validator("target_temp", pre=True)
-    def clamp_target_temp(cls, v, values):
-        mode = values.get("mode")
-        try:
-            val = float(v)
-        except Exception:
-            raise ValueError("target_temp must be a number")
-        if mode == 5:
+    mode: Literal[0, 5, 6]  # 0 (off), 5 (room mode), or 6 (heater mode)
+    target_temp: float      # Desired target temperature in ºC
+
+    @model_validator(mode="after")
+    def clamp_target_temp(self):
+        val = self.target_temp
+        if self.mode == 5:
             if val < 15.0:
-                print(f"Clamping room temperature {val}°C to 15.0°C")
-                return 15.0
+                log.info(f"Clamping room temperature {val}°C to 15.0°C")
+                self.target_temp = 15.0
             elif val > 29.9:
-                print(f"Clamping room temperature {val}°C to 29.9°C")
-                return 29.9
-        elif mode == 6:
+                log.info(f"Clamping room temperature {val}°C to 29.9°C")
+                self.target_temp = 29.9
+        elif self.mode == 6:
             if val < 29.9:
-                print(f"Clamping heater temperature {val}°C to 29.9°C")
-                return 29.9
+                log.info(f"Clamping heater temperature {val}°C to 29.9°C")
+                self.target_temp = 29.9
             elif val > 59.8:
-                print(f"Clamping heater temperature {val}°C to 59.8°C")
-                return 59.8
-        return val
-
-async def retry_read_status(address: str, retries: int = 5, delay: float = 5.0, timeout: float = 5.0):
-    last_error = None
-    for i in range(retries):
-        try:
-            print(f"[retry_read_status] Attempting to read status for {address} (try {i+1} of {retries})...")
-            result = await asyncio.wait_for(read_status(address), timeout=timeout)
-            print("[retry_read_status] Status read successfully.")
-            return result
-        except Exception as e:
-            last_error = e
-            print(f"[retry_read_status] Retry {i+1}/{retries} failed: {repr(e)}")
-            await asyncio.sleep(delay)
-    raise last_error
+                log.info(f"Clamping heater temperature {val}°C to 59.8°C")
+                self.target_temp = 59.8
+        return self
 
 #########################################################################
 # ENDPOINTS
@@ -432,43 +508,87 @@ async def retry_read_status(address: str, retries: int = 5, delay: float = 5.0,
 
 @app.get("/status")
 async def get_status(address: str = Query(..., description="BLE address, e.g., CC:22:37:10:43:4B")):
-    print(f"[API] Received /status command for device: {address}")
+    log.info(f"[API] Received /status command for device: {address}")
     try:
-        return await read_status(address)
+        return await get_persistent_client(address).read_status_coalesced()
     except Exception as e:
-        print(f"[API] /status command failed: {repr(e)}")
+        log.error(f"[API] /status command failed: {repr(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/query-device")
 async def query_device_endpoint(address: str = Query(..., description="BLE address, e.g., CC:22:37:10:43:4B")):
-    print(f"[API] Received /query-device command for address: {address}")
-    max_attempts = 3
-    for attempt in range(max_attempts):
-        try:
-            query = await query_device(address)
-            break
-        except Exception as e:
-            if attempt < max_attempts - 1:
-                print(f"[API] Attempt {attempt + 1} failed: {e}. Retrying...")
-                await asyncio.sleep(3)
-            else:
-                raise Exception(f"All {max_attempts} attempts failed: {e}")
-    return query
+    log.info(f"[API] Received /query-device command for address: {address}")
+    return await query_device(address)
+
+# Delays between successive status reads when verifying a set command, so that it completes as soon
+# as the device reports the new values rather than always waiting a fixed time.
+SET_VERIFY_DELAYS = (0.3, 0.5, 1.0, 1.5)
 
-async def set_thermostat(address: str, req: SetRequest):
-    expected_mode = req.mode
+def status_matches_request(status: dict, req: SetRequest) -> bool:
     expected_target = req.target_temp
+    if req.mode == 5:
+        actual = status.get("room_target_temp", 0)
+        if abs(actual - expected_target) < 0.5:
+            log.info(f"[set_thermostat] Status verified for mode 5: {actual}°C (expected {expected_target}°C)")
+            return True
+        log.info(f"[set_thermostat] room_target_temp {actual}°C != expected {expected_target}°C")
+    elif req.mode == 6:
+        actual = status.get("heater_target_temp", 0)
+        if abs(actual - expected_target) < 0.5:
+            log.info(f"[set_thermostat] Status verified for mode 6: {actual}°C (expected {expected_target}°C)")
+            return True
+        log.info(f"[set_thermostat] heater_target_temp {actual}°C != expected {expected_target}°C")
+    else:
+        if status.get("mode") == 0:
+            log.info("[set_thermostat] Status verified as mode 0 (off)")
+            return True
+        log.info(f"[set_thermostat] Reported mode ({status.get('mode')}) != expected (0)")
+    return False
+
+def notification_matches_request(latest: dict, req: SetRequest) -> bool:
+    """
+    Checks values notified by the device since the last write against the request. For mode 0
+    the mode must have been notified; for modes 5 and 6 the target temperature must have been,
+    since the mode alone is notified straight away when it is unchanged. Every notified value
+    must agree with the request.
+    """
+    checks = {OPERATING_MODE_UUID: lambda data: len(data) >= 1 and data[0] == req.mode}
+    temp_uuid = {5: ROOM_TEMP_UUID, 6: HEATER_TEMP_UUID}.get(req.mode)
+    if temp_uuid is not None:
+        checks[temp_uuid] = lambda data: abs(decode_temperature(data)[1] - req.target_temp) < 0.5
+    required = temp_uuid if temp_uuid is not None else OPERATING_MODE_UUID
+    notified = [uuid for uuid in checks if uuid in latest]
+    try:
+        return required in latest and all(checks[uuid](latest[uuid]) for uuid in notified)
+    except ValueError:
+        return False
+
+async def set_thermostat(address: str, req: SetRequest, current_status: dict = None):
+    """
+    Writes the requested mode and target temperature and waits for the device to confirm them.
+    If current_status (a recent read_status result) shows the device is already in the requested
+    state, nothing is written.
+    """
+    if current_status is not None and current_status.get("mode") == req.mode:
+        # Compare the encoded target exactly; status_matches_request's tolerance is only for
+        # verifying read-back and would swallow small setpoint changes.
+        target_key = {5: "room_target_temp", 6: "heater_target_temp"}.get(req.mode)
+        already_set = target_key is None or \
+            round(current_status.get(target_key, 0) * 10) == round(req.target_temp * 10)
+    else:
+        already_set = False
+    if already_set:
+        log.debug("[set_thermostat] Device already in requested state, nothing to write.")
+        return current_status
     max_attempts = 3
     attempt = 0
+    address = validate_address(address)
+    persistent_client = get_persistent_client(address)
     while attempt < max_attempts:
-        print(f"[set_thermostat] Attempt {attempt+1}: mode={req.mode}, target_temp={req.target_temp}")
-        address = validate_address(address)
-        persistent_client = get_persistent_client(address)
+        log.debug(f"[set_thermostat] Attempt {attempt+1}: mode={req.mode}, target_temp={req.target_temp}")
         client = await persistent_client.connect()
-        try:
-            await client.get_services()
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error retrieving services: {str(e)}")
+        if persistent_client.services_cache is None:
+            raise HTTPException(status_code=500, detail="Error retrieving services.")
         
         if req.mode == 5:
             temp_uuid = ROOM_TEMP_UUID
@@ -477,219 +597,311 @@ async def set_thermostat(address: str, req: SetRequest):
         else:
             temp_uuid = None
 
+        # Forget earlier notifications so that only values sent in response to this write count.
+        persistent_client.latest.clear()
         if temp_uuid is None:
-            print("[set_thermostat] Clearing current config (setting device to mode 0=off)")
+            log.debug("[set_thermostat] Clearing current config (setting device to mode 0=off)")
             try:
-                await client.write_gatt_char(OPERATING_MODE_UUID, bytes([0]), response=False)
-                print("[set_thermostat] Device set to mode 0 (off).")
+                async with BLE_SEMAPHORE:
+                    await client.write_gatt_char(OPERATING_MODE_UUID, bytes([0]), response=False)
+                log.info("[set_thermostat] Device set to mode 0 (off).")
             except Exception as e:
-                print(f"[set_thermostat] Could not set device to off: {e}")
+                log.warning(f"[set_thermostat] Could not set device to off: {e}")
         else:
             payload = encode_temperature(req.target_temp)
-            print(f"[set_thermostat] Writing temperature payload {payload.hex()} to {temp_uuid}")
+            log.debug(f"[set_thermostat] Writing temperature payload {payload.hex()} to {temp_uuid}")
             try:
-                await client.write_gatt_char(temp_uuid, payload, response=False)
+                async with BLE_SEMAPHORE:
+                    await client.write_gatt_char(temp_uuid, payload, response=False)
             except Exception as e:
                 raise Exception(f"Failed to write target temperature: {e}")
             mode_payload = bytes([req.mode])
-            print(f"[set_thermostat] Writing operating mode {mode_payload.hex()} to {OPERATING_MODE_UUID}")
+            log.debug(f"[set_thermostat] Writing operating mode {mode_payload.hex()} to {OPERATING_MODE_UUID}")
             try:
-                await client.write_gatt_char(OPERATING_MODE_UUID, mode_payload, response=False)
+                async with BLE_SEMAPHORE:
+                    await client.write_gatt_char(OPERATING_MODE_UUID, mode_payload, response=False)
             except Exception as e:
-                print(f"[set_thermostat] Failed to write operating mode: {e}")
-
-        print("[set_thermostat] Write commands completed, waiting for device to re-advertise...")
-        await asyncio.sleep(3)
-        print("[set_thermostat] Reading status after set command...")
-        try:
-            status = await read_status(address)
-        except Exception as e:
-            print(f"[set_thermostat] Failed to read status: {e}")
-            status = None
-
-        if status is not None:
-            if req.mode == 5:
-                actual = status.get("room_target_temp", 0)
-                if abs(actual - expected_target) < 0.5:
-                    print(f"[set_thermostat] Status verified for mode 5: {actual}°C (expected {expected_target}°C)")
-                    return status
-                else:
-                    print(f"[set_thermostat] room_target_temp {actual}°C != expected {expected_target}°C")
-            elif req.mode == 6:
-                actual = status.get("heater_target_temp", 0)
-                if abs(actual - expected_target) < 0.5:
-                    print(f"[set_thermostat] Status verified for mode 6: {actual}°C (expected {expected_target}°C)")
-                    return status
-                else:
-                    print(f"[set_thermostat] heater_target_temp {actual}°C != expected {expected_target}°C")
+                log.warning(f"[set_thermostat] Failed to write operating mode: {e}")
+
+        # Make sure the next /status poll reads the device rather than returning pre-write values.
+        persistent_client.invalidate_status_cache()
+        if persistent_client.notifications_enabled:
+            log.debug("[set_thermostat] Write commands completed, waiting for device to notify new values...")
+            if await persistent_client.wait_for_notification(
+                    lambda latest: notification_matches_request(latest, req), timeout=3.0):
+                try:
+                    status = await read_status(address)
+                    if status_matches_request(status, req):
+                        return status
+                except Exception as e:
+                    log.warning(f"[set_thermostat] Failed to read status: {e}")
             else:
-                if status.get("mode") == 0:
-                    print("[set_thermostat] Status verified as mode 0 (off)")
-                    return status
-                else:
-                    print(f"[set_thermostat] Reported mode ({status.get('mode')}) != expected (0)")
-        print(f"[set_thermostat] Retrying set command (attempt {attempt+1}/{max_attempts})...")
+                log.debug("[set_thermostat] No matching notification received.")
+        log.debug("[set_thermostat] Write commands completed, polling device for the new values...")
+        for delay in SET_VERIFY_DELAYS:
+            await asyncio.sleep(delay)
+            log.debug("[set_thermostat] Reading status after set command...")
+            try:
+                status = await read_status(address)
+            except Exception as e:
+                log.warning(f"[set_thermostat] Failed to read status: {e}")
+                continue
+            if status_matches_request(status, req):
+                return status
+        log.info(f"[set_thermostat] Retrying set command (attempt {attempt+1}/{max_attempts})...")
         attempt += 1
 
-    print("[set_thermostat] Failed to set expected values after 3 attempts. Setting device to mode 0 (off).")
+    log.error("[set_thermostat] Failed to set expected values after 3 attempts. Setting device to mode 0 (off).")
     try:
-        await client.write_gatt_char(OPERATING_MODE_UUID, bytes([0]), response=False)
-        print("[set_thermostat] Device set to mode 0 (off).")
+        async with BLE_SEMAPHORE:
+            await client.write_gatt_char(OPERATING_MODE_UUID, bytes([0]), response=False)
+        log.info("[set_thermostat] Device set to mode 0 (off).")
     except Exception as e:
-        print(f"[set_thermostat] Failed to set device to off: {e}")
+        log.error(f"[set_thermostat] Failed to set device to off: {e}")
     return {"mode": 0, "error": "Failed to set expected values after 3 attempts; device turned off."}
 
+CLEAR_REQUEST = SetRequest(mode=0, target_temp=20.0)
+
 @app.get("/set")
 async def set_thermostat_get(address: str = Query(..., description="BLE address, e.g., CC:22:37:10:43:4B"),
                              mode: int = Query(0, description="Mode: 0, 5, or 6"),
                              temp: float = Query(20.0, description="Target temperature in ºC")):
-    print(f"[API] Received GET /set command for device: {address} with mode={mode}, temp={temp}")
-    # First clear device config (set to off)
+    log.info(f"[API] Received GET /set command for device: {address} with mode={mode}, temp={temp}")
     try:
-        req = SetRequest(mode=0, target_temp=20.0)
-        result = await set_thermostat(address, req)
-        print("[API] Initial clear command completed.")
+        current_status = await get_persistent_client(address).read_status_coalesced()
     except Exception as e:
-        print(f"[API] /set command failed during clear: {repr(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        log.warning(f"[API] Could not read current status before /set, will clear first: {repr(e)}")
+        current_status = None
+
+    # First clear device config (set to off), unless the device is already off or already in the
+    # requested mode. Switching directly between modes 5 and 6 is what corrupts target temperatures.
+    current_mode = current_status.get("mode") if current_status is not None else None
+    if mode not in [5, 6] or current_mode not in (0, mode):
+        try:
+            result = await set_thermostat(address, CLEAR_REQUEST, current_status)
+            current_status = result if "error" not in result else None
+            log.debug("[API] Initial clear command completed.")
+        except Exception as e:
+            log.error(f"[API] /set command failed during clear: {repr(e)}")
+            raise HTTPException(status_code=500, detail=str(e))
 
     # If mode 5 or 6 is requested, set accordingly.
     if mode in [5, 6]:
         try:
             req = SetRequest(mode=mode, target_temp=temp)
-            result = await set_thermostat(address, req)
-            print("[API] /set command completed.")
+            result = await set_thermostat(address, req, current_status)
+            log.debug("[API] /set command completed.")
             return result
         except Exception as e:
-            print(f"[API] /set command failed: {repr(e)}")
+            log.error(f"[API] /set command failed: {repr(e)}")
             raise HTTPException(status_code=500, detail=str(e))
     else:
         return result
 
 @app.get("/discover")
-async def find_all_devices(timeout: float = 15.0):
+async def find_all_devices(timeout: float = 5.0):
     """
     Returns a list of all visible Bluetooth devices.
     """
-    print(f"[API] Received /discover command with timeout={timeout}")
-    devices = await BleakScanner.discover(timeout=timeout)
-    return [{"address": device.address, "name": device.name} for device in devices]
+    log.info(f"[API] Received /discover command with timeout={timeout}")
+    found = {}
+
+    def detection_callback(device, advertisement_data):
+        found[device.address] = device.name or advertisement_data.local_name
+
+    async with BleakScanner(detection_callback=detection_callback):
+        await asyncio.sleep(timeout)
+    return [{"address": address, "name": name} for address, name in found.items()]
 
 #########################################################################
-# BLUETOOTH PAIRING FUNCTION (using bluetoothctl via pexpect)
+# BLUETOOTH PAIRING FUNCTION (using bluetoothctl via an asyncio subprocess)
 #
-logging.basicConfig(level=logging.WARNING, format='%(asctime)s [%(levelname)s] %(message)s')
+class AsyncBluetoothctl:
+    """
+    Drives an interactive bluetoothctl process with pexpect-style sendline/expect calls,
+    without blocking the event loop while waiting for output.
+    """
+    def __init__(self, proc, master_fd, reader, transport, logfile=None):
+        self.proc = proc
+        self.master_fd = master_fd
+        self.reader = reader
+        self.transport = transport
+        self.logfile = logfile
+        self.buffer = ""
+
+    @classmethod
+    async def spawn(cls, logfile=None):
+        # bluetoothctl only runs its interactive shell (prompts, passkey requests) on a terminal,
+        # so run it on a pty as pexpect did rather than on plain pipes.
+        master_fd, slave_fd = pty.openpty()
+        try:
+            proc = await asyncio.create_subprocess_exec("bluetoothctl",
+                                                        stdin=slave_fd,
+                                                        stdout=slave_fd,
+                                                        stderr=slave_fd,
+                                                        start_new_session=True)
+        except Exception:
+            os.close(master_fd)
+            raise
+        finally:
+            os.close(slave_fd)
+        reader = asyncio.StreamReader()
+        transport, _ = await asyncio.get_running_loop().connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(master_fd, "rb", buffering=0))
+        return cls(proc, master_fd, reader, transport, logfile)
+
+    async def sendline(self, line=""):
+        os.write(self.master_fd, f"{line}\n".encode())
+
+    async def expect(self, patterns, timeout=5):
+        """
+        Waits until one of patterns (a string, compiled regex, or a list of these) appears
+        in the output, consuming output up to the end of the match. Returns the index of the
+        matching pattern, or raises asyncio.TimeoutError.
+        """
+        if not isinstance(patterns, list):
+            patterns = [patterns]
+        patterns = [p if isinstance(p, re.Pattern) else re.compile(re.escape(p)) for p in patterns]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            for index, pattern in enumerate(patterns):
+                match = pattern.search(self.buffer)
+                if match:
+                    self.buffer = self.buffer[match.end():]
+                    return index
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            try:
+                chunk = await asyncio.wait_for(self.reader.read(1024), timeout=remaining)
+            except OSError:
+                chunk = b""  # The pty reports EIO once bluetoothctl has exited
+            if not chunk:
+                raise EOFError("bluetoothctl exited")
+            text = chunk.decode("utf-8", errors="replace")
+            if self.logfile is not None:
+                self.logfile.write(text)
+                self.logfile.flush()
+            self.buffer += text
+
+    async def close(self):
+        # Closing the pty master hangs up bluetoothctl's terminal, which makes it exit.
+        self.transport.close()
+        if self.proc.returncode is None:
+            try:
+                await asyncio.wait_for(self.proc.wait(), timeout=2)
+            except Exception:
+                self.proc.kill()
+                await self.proc.wait()
 
-def send_command(child, command, expected_pattern, timeout=2, retries=3):
+async def send_command(child, command, expected_pattern, timeout=2, retries=3):
     for attempt in range(1, retries + 1):
-        logging.info(f"Sending command: {command} (attempt {attempt})")
-        child.sendline(command)
+        log.info(f"Sending command: {command} (attempt {attempt})")
+        await child.sendline(command)
         try:
-            child.expect(expected_pattern, timeout=timeout)
-            logging.info(f"Expected output received for command: {command}")
+            await child.expect(expected_pattern, timeout=timeout)
+            log.info(f"Expected output received for command: {command}")
             return True
-        except pexpect.TIMEOUT:
-            logging.warning(f"Timeout waiting for '{expected_pattern}' after command: {command}")
+        except asyncio.TimeoutError:
+            log.warning(f"Timeout waiting for '{expected_pattern}' after command: {command}")
             if attempt < retries:
-                logging.info("Retrying command...")
+                log.info("Retrying command...")
             else:
-                logging.error(f"Failed after {retries} attempts: {command}")
+                log.error(f"Failed after {retries} attempts: {command}")
     return False
 
 @app.get("/pair")
 async def pair_device(address: str = Query(..., description="BLE address, e.g., CC:22:37:10:43:4B"),
                       pin: str = Query("123456", description="Device connect PIN")):
-    print(f"[API] Received /pair command for device: {address} with pin={pin}")
+    log.info(f"[API] Received /pair command for device: {address} with pin={pin}")
     address = validate_address(address)
     max_overall_retries = 3
     for overall_attempt in range(1, max_overall_retries + 1):
-        logging.info(f"Overall pairing attempt {overall_attempt} for device {address}")
-        child = pexpect.spawn("bluetoothctl", encoding="utf-8", timeout=5)
-        child.logfile = sys.stdout
+        log.info(f"Overall pairing attempt {overall_attempt} for device {address}")
+        child = await AsyncBluetoothctl.spawn(
+            logfile=sys.stdout if log.isEnabledFor(logging.DEBUG) else None)
 
         try:
-            if not send_command(child, "", re.compile(r'\[bluetooth\]'), timeout=5):
+            if not await send_command(child, "", re.compile(r'\[bluetooth\]'), timeout=5):
                 raise Exception("Initial prompt not received")
             
-            child.sendline(f"remove {address}")
-            if not send_command(child, "", re.compile(r'\[bluetooth\]'), timeout=5):
+            await child.sendline(f"remove {address}")
+            if not await send_command(child, "", re.compile(r'\[bluetooth\]'), timeout=5):
                 raise Exception("After remove command")
             
-            if not send_command(child, "agent KeyboardOnly", re.compile(r'\[bluetooth\]'), timeout=5):
+            if not await send_command(child, "agent KeyboardOnly", re.compile(r'\[bluetooth\]'), timeout=5):
                 raise Exception("Agent command failed")
-            if not send_command(child, "default-agent", re.compile(r"Default agent request successful"), timeout=2):
+            if not await send_command(child, "default-agent", re.compile(r"Default agent request successful"), timeout=2):
                 raise Exception("Default agent command failed")
             
-            if not send_command(child, "power on", re.compile(r'\[bluetooth\]'), timeout=5):
+            if not await send_command(child, "power on", re.compile(r'\[bluetooth\]'), timeout=5):
                 raise Exception("Power on command failed")
             
-            logging.info("Starting scan...")
-            child.sendline("scan on")
+            log.info("Starting scan...")
+            await child.sendline("scan on")
             try:
-                child.expect(f"{address}", timeout=30)
-                logging.info(f"Device {address} detected during scan.")
-            except pexpect.TIMEOUT:
+                await child.expect(f"{address}", timeout=30)
+                log.info(f"Device {address} detected during scan.")
+            except asyncio.TimeoutError:
                 raise Exception(f"Timeout waiting for {address} to appear in list.")
             
-            time.sleep(2)
-            logging.info(f"Connecting to device {address}...")
+            await asyncio.sleep(2)
+            log.info(f"Connecting to device {address}...")
             max_connect_retries = 3
             connection_successful = False
             for attempt in range(1, max_connect_retries + 1):
-                child.sendline(f"connect {address}")
+                await child.sendline(f"connect {address}")
                 try:
-                    child.expect("Connection successful", timeout=5)
-                    logging.info("Connection successful received.")
-                    child.expect(f"{address} ServicesResolved: yes", timeout=15)
-                    logging.info("Services confirmed.")
+                    await child.expect("Connection successful", timeout=5)
+                    log.info("Connection successful received.")
+                    await child.expect(f"{address} ServicesResolved: yes", timeout=15)
+                    log.info("Services confirmed.")
                     connection_successful = True
                     break
-                except pexpect.TIMEOUT:
-                    logging.warning("No response after connect command. Retrying connect...")
+                except asyncio.TimeoutError:
+                    log.warning("No response after connect command. Retrying connect...")
             if not connection_successful:
                 raise Exception("Failed to connect after multiple attempts.")
             
-            time.sleep(1)
-            if not send_command(child, f"trust {address}", re.compile(r"trust succeeded"), timeout=2):
+            await asyncio.sleep(1)
+            if not await send_command(child, f"trust {address}", re.compile(r"trust succeeded"), timeout=2):
                 raise Exception("Trust command failed")
             
-            time.sleep(1)
-            logging.info(f"Pairing with device {address}...")
-            child.sendline(f"pair {address}")
+            await asyncio.sleep(1)
+            log.info(f"Pairing with device {address}...")
+            await child.sendline(f"pair {address}")
             try:
-                index = child.expect([
+                index = await child.expect([
                     re.compile(r"Enter passkey"),
                     re.compile(r"Request passkey"),
-                    re.compile(r"Pairing successful"),
-                    pexpect.TIMEOUT
+                    re.compile(r"Pairing successful")
                 ], timeout=5)
                 if index in [0, 1]:
-                    logging.info(f"Passkey prompt detected. Sending PIN: {pin}")
-                    child.sendline(pin)
-                    child.expect("Pairing successful", timeout=5)
-                    logging.info("Pairing successful!")
-                elif index == 2:
-                    logging.info("Pairing successful (no passkey prompt).")
+                    log.info(f"Passkey prompt detected. Sending PIN: {pin}")
+                    await child.sendline(pin)
+                    await child.expect("Pairing successful", timeout=5)
+                    log.info("Pairing successful!")
                 else:
-                    raise Exception("Pairing failed: unexpected response or timeout.")
-            except pexpect.TIMEOUT:
+                    log.info("Pairing successful (no passkey prompt).")
+            except asyncio.TimeoutError:
                 raise Exception("Pairing failed: operation timed out.")
             
-            logging.info("Device paired successfully!")
-            if not send_command(child, "power off", re.compile(r'\[bluetooth\]'), timeout=5):
+            log.info("Device paired successfully!")
+            if not await send_command(child, "power off", re.compile(r'\[bluetooth\]'), timeout=5):
                 raise Exception("Power off command failed")
-            if not send_command(child, "power on", re.compile(r'\[bluetooth\]'), timeout=5):
+            if not await send_command(child, "power on", re.compile(r'\[bluetooth\]'), timeout=5):
                 raise Exception("Power on command failed")
-            time.sleep(1)
-            logging.info("Exiting bluetoothctl...")
-            child.sendline("exit")
-            child.close()
+            await asyncio.sleep(1)
+            log.info("Exiting bluetoothctl...")
+            await child.sendline("exit")
+            await child.close()
             return {"pairing": "success"}
         except Exception as e:
-            logging.error(f"Error encountered: {e}. Retrying entire pairing process after 3 seconds.")
-            child.close()
-            time.sleep(3)
-    logging.error("All overall pairing attempts failed.")
+            log.error(f"Error encountered: {e}. Retrying entire pairing process after 3 seconds.")
+            await child.close()
+            await asyncio.sleep(3)
+    log.error("All overall pairing attempts failed.")
     raise HTTPException(status_code=500, detail={"pairing": "failed"})
 
 #########################################################################
@@ -699,4 +911,7 @@ if __name__ == "__main__":
     if any(arg in ("--help", "-h", "?") for arg in sys.argv[1:]):
         print(HELP)
         sys.exit(0)
-    uvicorn.run("moa_web_server:app", host="0.0.0.0", port=8080)
+    # Each process keeps its own persistent device connections, so to spread several elements over
+    # several processes run one instance per port (see INSTALLATION) rather than uvicorn workers.
+    port = int(os.environ.get("MOA_PORT", "8080"))
+    uvicorn.run("moa_web_server:app", host="0.0.0.0", port=port, loop="uvloop", http="httptools")
@@ -0,0 +1,18 @@
+import pytest
+
+from moa_web_server import decode_temperature, encode_temperature
+
+
+@pytest.mark.parametrize("target", [15.0, 25.5, 25.6, 29.9, 59.8])
+def test_temperature_round_trip(target):
+    assert decode_temperature(encode_temperature(target)) == (0.0, target)
+
+
+def test_encode_temperature_is_big_endian_tenths():
+    assert encode_temperature(59.8) == bytes([0, 0, 0x02, 0x56])
+
+
+@pytest.mark.parametrize("target", [-0.1, 6553.6])
+def test_encode_temperature_out_of_range(target):
+    with pytest.raises(ValueError):
+        encode_temperature(target)